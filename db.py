@@ -1,7 +1,15 @@
+import time
+
 import psycopg2
+from psycopg2 import pool
 
-from config import DB_HOST, DB_DATABASE, DB_USER, DB_PASSWORD, DB_PORT
-from typing import Dict, List, Set, Tuple
+from config import (
+    DB_HOST, DB_DATABASE, DB_USER, DB_PASSWORD, DB_PORT, DB_POOL_MAX_CONNECTIONS,
+    REPLICA_CONNECT_TIMEOUT_SECONDS, REPLICA_RETRY_COOLDOWN_SECONDS
+)
+from query_executor import end_open_transaction, is_read_only_query
+from psycopg2 import sql
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 
 def get_connection():
@@ -16,6 +24,196 @@ def get_connection():
     return conn
 
 
+def get_connection_pool(max_connections: int = DB_POOL_MAX_CONNECTIONS):
+    """
+    Creates a thread-safe pool of PostgreSQL connections.
+
+    All connections are opened up front and kept open when returned, so that
+    later requests reuse them instead of reconnecting.
+    """
+    return pool.ThreadedConnectionPool(
+        max_connections,
+        max_connections,
+        host=DB_HOST,
+        database=DB_DATABASE,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        port=DB_PORT
+    )
+
+
+class ReplicaRouter:
+    """Routes read-only queries to read replicas, falling back to the primary connection."""
+
+    def __init__(
+            self,
+            primary,
+            replica_dsns: List[str],
+            max_lag_seconds: float,
+            connect_timeout: int = REPLICA_CONNECT_TIMEOUT_SECONDS,
+            retry_cooldown: float = REPLICA_RETRY_COOLDOWN_SECONDS
+    ):
+        self.primary = primary
+        self.replica_dsns = replica_dsns
+        self.max_lag_seconds = max_lag_seconds
+        self.connect_timeout = connect_timeout
+        self.retry_cooldown = retry_cooldown
+        self._replicas = {}  # dsn -> connection
+        self._unavailable_until: Dict[str, float] = {}  # dsn -> time.monotonic() deadline
+        self._schema_connection = None
+
+    def connection_for(self, query: str):
+        """
+        Return the connection a query should run on.
+
+        Read-only queries go to the least-loaded replica whose replication lag
+        is under the threshold; everything else runs on the primary.
+        """
+        if not is_read_only_query(query):
+            return self.primary
+
+        dsn = self._least_loaded_replica()
+        return self._replicas[dsn] if dsn else self.primary
+
+    def schema_connection(self, node: str):
+        """
+        Return the connection used for schema introspection ('primary' or 'replica').
+
+        A replica used for introspection gets its own connection, which the
+        router never hands out for queries nor closes when probing replicas.
+        """
+        if node != 'replica':
+            return self.primary
+
+        if self._schema_connection is None or self._schema_connection.closed:
+            dsn = self._least_loaded_replica()
+            if dsn is None:
+                return self.primary
+            self._schema_connection = self._connect(dsn)
+
+        return self._schema_connection or self.primary
+
+    def has_stats_privilege(self) -> bool:
+        """
+        Check whether the role can read other sessions' statistics on every reachable replica.
+
+        Without pg_read_all_stats (or pg_monitor), PostgreSQL hides the WAL receiver
+        status and the state of other sessions, so caught-up replicas look lagged
+        and load is only counted for this role's own sessions.
+        """
+        for dsn in self.replica_dsns:
+            conn = self._get_replica(dsn)
+            if conn is None:
+                continue
+            try:
+                end_open_transaction(conn)
+                cursor = conn.cursor()
+                cursor.execute("SELECT pg_has_role('pg_read_all_stats', 'USAGE');")
+                granted = cursor.fetchone()[0]
+                cursor.close()
+                conn.rollback()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                # Broken connections are dealt with when the replica is next probed
+                continue
+            except psycopg2.Error:
+                conn.rollback()
+                continue
+            if not granted:
+                return False
+        return True
+
+    def close(self):
+        """Close all replica connections."""
+        for conn in self._replicas.values():
+            conn.close()
+        self._replicas.clear()
+        if self._schema_connection is not None:
+            self._schema_connection.close()
+
+    def _least_loaded_replica(self) -> Optional[str]:
+        """Find the replica with the fewest active queries among those within the lag threshold."""
+        candidates = []
+        for dsn in self.replica_dsns:
+            if time.monotonic() < self._unavailable_until.get(dsn, 0):
+                continue
+
+            conn = self._get_replica(dsn)
+            if conn is None:
+                continue
+
+            status = self._replica_status(dsn, conn)
+            if status is None:
+                continue
+
+            lag, active_queries = status
+            if lag is not None and lag <= self.max_lag_seconds:
+                candidates.append((active_queries, dsn))
+
+        if not candidates:
+            return None
+        return min(candidates, key=lambda candidate: candidate[0])[1]
+
+    def _connect(self, dsn: str):
+        """Connect to a replica, putting it on cooldown if it cannot be reached."""
+        try:
+            return psycopg2.connect(dsn, connect_timeout=self.connect_timeout)
+        except psycopg2.Error:
+            self._unavailable_until[dsn] = time.monotonic() + self.retry_cooldown
+            return None
+
+    def _get_replica(self, dsn: str):
+        """Return a cached connection to a replica, reconnecting if it was closed."""
+        conn = self._replicas.get(dsn)
+        if conn is not None and not conn.closed:
+            return conn
+
+        conn = self._connect(dsn)
+        if conn is not None:
+            self._replicas[dsn] = conn
+        return conn
+
+    def _replica_status(self, dsn: str, conn) -> Optional[Tuple[Optional[float], int]]:
+        """
+        Return the replication lag in seconds and the number of active queries on a replica.
+
+        The lag is zero when the WAL receiver is streaming and all received WAL
+        has been replayed, since an idle primary would otherwise make the replay
+        timestamp look stale. A replica that is not streaming falls back to the
+        age of the last replayed transaction, however long ago it received WAL.
+        """
+        try:
+            # A failed query routed here leaves the transaction aborted
+            end_open_transaction(conn)
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT
+                    CASE
+                        WHEN NOT pg_is_in_recovery() THEN 0
+                        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                            AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming')
+                            THEN 0
+                        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                    END,
+                    (SELECT count(*) FROM pg_stat_activity
+                     WHERE state = 'active' AND backend_type = 'client backend'
+                     AND pid <> pg_backend_pid());
+            """)
+            lag, active_queries = cursor.fetchone()
+            cursor.close()
+            conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The connection is broken; reconnect after the cooldown
+            conn.close()
+            del self._replicas[dsn]
+            self._unavailable_until[dsn] = time.monotonic() + self.retry_cooldown
+            return None
+        except psycopg2.Error:
+            conn.rollback()
+            return None
+
+        return (float(lag) if lag is not None else None), active_queries
+
+
 class SchemaAnalyzer:
     """Analyzes database schema to infer relationships and provide context to the LLM."""
 
@@ -24,22 +222,73 @@ class SchemaAnalyzer:
         self.tables: Dict[str, List[str]] = {}  # table_name -> [columns]
         self.foreign_keys: List[Tuple[str, str, str, str]] = []  # [(table, column, ref_table, ref_column)]
         self.primary_keys: Dict[str, str] = {}  # table_name -> primary_key_column
+        self.table_sizes: Dict[str, int] = {}  # table_name -> estimated row count (pg_class.reltuples)
+        self._table_sections: Dict[str, str] = {}  # table_name -> rendered description section
 
     def analyze(self) -> str:
         """
         Analyzes the database schema and returns a detailed description
         formatted specifically to help the LLM understand the structure.
+
+        Can be called again to re-introspect the whole schema from scratch.
         """
+        self.tables = {}
+        self.primary_keys = {}
+        self.table_sizes = {}
+        self._table_sections = {}
         self._extract_table_info()
         self._extract_relationships()
         return self._generate_schema_description()
 
-    def _extract_table_info(self):
+    def refresh(self, tables: Set[str]) -> str:
+        """
+        Re-introspect only the given tables and return the updated schema description.
+
+        Tables that no longer exist are removed. Foreign keys from or to the
+        given tables are reloaded, and only their description sections are re-rendered.
+
+        Known tables are also checked against the tables that currently exist,
+        since a rename or a move out of the public schema is only reported
+        under the table's new name.
+        """
+        # End any open transaction so the catalog queries see the latest schema
+        self.connection.rollback()
+
+        existing = self._existing_tables()
+        tables = set(tables) | (set(self.tables) - existing) | (existing - set(self.tables))
+
+        for table in tables:
+            self.tables.pop(table, None)
+            self.primary_keys.pop(table, None)
+            self.table_sizes.pop(table, None)
+            self._table_sections.pop(table, None)
+
+        self._extract_table_info(tables)
+        self._extract_relationships(tables)
+        self.tables = dict(sorted(self.tables.items()))
+        return self._generate_schema_description()
+
+    def _existing_tables(self) -> Set[str]:
+        """Return the names of all base tables currently in the public schema."""
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT table_name
+            FROM information_schema.tables
+            WHERE table_schema = 'public'
+            AND table_type = 'BASE TABLE';
+        """)
+        existing = {table for table, in cursor.fetchall()}
+        cursor.close()
+        return existing
+
+    def _extract_table_info(self, only_tables: Optional[Iterable[str]] = None):
         """Extract detailed information about tables and their columns."""
         cursor = self.connection.cursor()
+        table_filter = "AND t.table_name = ANY(%(tables)s)" if only_tables is not None else ""
+        params = {'tables': list(only_tables or [])}
 
         # Get tables and columns with types
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT 
                 t.table_name,
                 c.column_name,
@@ -50,8 +299,9 @@ class SchemaAnalyzer:
             JOIN information_schema.columns c ON t.table_name = c.table_name
             WHERE t.table_schema = 'public'
             AND t.table_type = 'BASE TABLE'
+            {table_filter}
             ORDER BY t.table_name, c.ordinal_position;
-        """)
+        """, params)
 
         for table, column, data_type, is_nullable, default in cursor.fetchall():
             if table not in self.tables:
@@ -64,26 +314,54 @@ class SchemaAnalyzer:
             })
 
         # Get primary keys
-        cursor.execute("""
+        table_filter = "AND tc.table_name = ANY(%(tables)s)" if only_tables is not None else ""
+        cursor.execute(f"""
             SELECT 
                 tc.table_name, kcu.column_name
             FROM information_schema.table_constraints tc
             JOIN information_schema.key_column_usage kcu
                 ON tc.constraint_name = kcu.constraint_name
             WHERE tc.constraint_type = 'PRIMARY KEY'
-            AND tc.table_schema = 'public';
-        """)
+            AND tc.table_schema = 'public'
+            {table_filter};
+        """, params)
 
         for table, column in cursor.fetchall():
             self.primary_keys[table] = column
 
+        # Get estimated row counts from planner statistics
+        table_filter = "AND c.relname = ANY(%(tables)s)" if only_tables is not None else ""
+        cursor.execute(f"""
+            SELECT c.relname, c.reltuples
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'public'
+            AND c.relkind IN ('r', 'p')
+            {table_filter};
+        """, params)
+
+        for table, reltuples in cursor.fetchall():
+            # reltuples is -1 for tables that have never been analyzed
+            self.table_sizes[table] = max(int(reltuples), 0)
+
         cursor.close()
 
-    def _extract_relationships(self):
+    def _extract_relationships(self, only_tables: Optional[Iterable[str]] = None):
         """Extract foreign key relationships between tables."""
         cursor = self.connection.cursor()
+        table_filter = ""
+        params = {'tables': list(only_tables or [])}
 
-        cursor.execute("""
+        if only_tables is None:
+            self.foreign_keys = []
+        else:
+            table_filter = "AND (tc.table_name = ANY(%(tables)s) OR ccu.table_name = ANY(%(tables)s))"
+            self.foreign_keys = [
+                fk for fk in self.foreign_keys
+                if fk[0] not in params['tables'] and fk[2] not in params['tables']
+            ]
+
+        cursor.execute(f"""
             SELECT
                 tc.table_name,
                 kcu.column_name,
@@ -95,10 +373,11 @@ class SchemaAnalyzer:
             JOIN information_schema.constraint_column_usage ccu
                 ON ccu.constraint_name = tc.constraint_name
             WHERE tc.constraint_type = 'FOREIGN KEY'
-            AND tc.table_schema = 'public';
-        """)
+            AND tc.table_schema = 'public'
+            {table_filter};
+        """, params)
 
-        self.foreign_keys = cursor.fetchall()
+        self.foreign_keys.extend(cursor.fetchall())
         cursor.close()
 
     def _generate_schema_description(self) -> str:
@@ -109,13 +388,10 @@ class SchemaAnalyzer:
 
         # Tables and their columns
         description.append("TABLES AND COLUMNS:")
-        for table_name, columns in self.tables.items():
-            description.append(f"\n{table_name.upper()} TABLE")
-            description.append("Columns:")
-            for col in columns:
-                nullable = "NULL" if col['nullable'] else "NOT NULL"
-                pk = " (PRIMARY KEY)" if self.primary_keys.get(table_name) == col['name'] else ""
-                description.append(f"- {col['name']}: {col['type']} {nullable}{pk}")
+        for table_name in self.tables:
+            if table_name not in self._table_sections:
+                self._table_sections[table_name] = self._render_table(table_name)
+            description.append(self._table_sections[table_name])
 
         # Relationships
         if self.foreign_keys:
@@ -133,6 +409,15 @@ class SchemaAnalyzer:
 
         return "\n".join(description)
 
+    def _render_table(self, table_name: str) -> str:
+        """Render the description section for a single table."""
+        section = [f"\n{table_name.upper()} TABLE", "Columns:"]
+        for col in self.tables[table_name]:
+            nullable = "NULL" if col['nullable'] else "NOT NULL"
+            pk = " (PRIMARY KEY)" if self.primary_keys.get(table_name) == col['name'] else ""
+            section.append(f"- {col['name']}: {col['type']} {nullable}{pk}")
+        return "\n".join(section)
+
     def suggest_joins(self, tables: Set[str]) -> List[str]:
         """
         Suggest possible JOIN clauses for the given set of tables.
@@ -147,4 +432,150 @@ class SchemaAnalyzer:
                     if (t1 == table and t2 == ref_table) or (t2 == table and t1 == ref_table):
                         joins.append(f"LEFT JOIN {ref_table} ON {table}.{column} = {ref_table}.{ref_column}")
 
-        return joins
\ No newline at end of file
+        return joins
+
+
+SCHEMA_CHANGE_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION prompt2query_notify_schema_change() RETURNS event_trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    changed RECORD;
+BEGIN
+    IF TG_EVENT = 'sql_drop' THEN
+        FOR changed IN
+            SELECT DISTINCT address_names[2] AS table_name
+            FROM pg_event_trigger_dropped_objects()
+            WHERE object_type IN ('table', 'table column', 'table constraint')
+            AND schema_name = 'public'
+        LOOP
+            PERFORM pg_notify({channel}, changed.table_name);
+        END LOOP;
+    ELSE
+        FOR changed IN
+            SELECT DISTINCT c.relname AS table_name
+            FROM pg_event_trigger_ddl_commands() cmd
+            JOIN pg_class c ON c.oid = cmd.objid
+            WHERE cmd.classid = 'pg_class'::regclass
+            AND cmd.object_type IN ('table', 'table column')
+        LOOP
+            PERFORM pg_notify({channel}, changed.table_name);
+        END LOOP;
+    END IF;
+END;
+$$;
+
+DROP EVENT TRIGGER IF EXISTS prompt2query_schema_change;
+CREATE EVENT TRIGGER prompt2query_schema_change ON ddl_command_end
+    EXECUTE FUNCTION prompt2query_notify_schema_change();
+
+DROP EVENT TRIGGER IF EXISTS prompt2query_schema_drop;
+CREATE EVENT TRIGGER prompt2query_schema_drop ON sql_drop
+    EXECUTE FUNCTION prompt2query_notify_schema_change();
+"""
+
+
+class SchemaWatcher:
+    """
+    Listens for schema change notifications sent by a DDL event trigger.
+
+    The trigger (see SCHEMA_CHANGE_TRIGGER_SQL) sends the name of each created,
+    altered or dropped table as the notification payload. Renamed or moved
+    tables are reported under their new name only. Creating event triggers
+    requires superuser rights, so DBAs may install it themselves instead.
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.connection = None
+        self._pending: Set[str] = set()
+        self._pending_lsn = None
+        self._resync = False  # notifications may have been missed while reconnecting
+
+    def start(self, install_trigger: bool = False):
+        """Open a dedicated connection and start listening on the channel."""
+        self.connection = get_connection()
+        self.connection.autocommit = True
+
+        cursor = self.connection.cursor()
+        if install_trigger:
+            cursor.execute(sql.SQL(SCHEMA_CHANGE_TRIGGER_SQL).format(channel=sql.Literal(self.channel)))
+        cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+        cursor.close()
+
+    def poll(self, schema_connection, replay_timeout: float = 2.0) -> Optional[Set[str]]:
+        """
+        Return the names of tables changed since the last poll.
+
+        Notifications come from the primary. When the schema is introspected on
+        a replica, changes are only returned once the replica has replayed the
+        primary's WAL up to the point they were received; until then they stay
+        pending, so a refresh never caches the old schema as fresh.
+
+        Returns:
+            The changed table names, or None if the listening connection was lost
+            and re-established, in which case notifications may have been missed
+            and the whole schema should be analyzed again
+
+        Raises:
+            psycopg2.OperationalError: If a lost connection could not be re-established
+        """
+        try:
+            changed = self._receive()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.close()
+            self.start()
+            self._resync = True
+            self._record_lsn()
+            changed = set()
+
+        self._pending |= changed
+        if not (self._pending or self._resync) or not self._wait_for_replay(schema_connection, replay_timeout):
+            return set()
+
+        if self._resync:
+            self._resync = False
+            self._pending = set()
+            return None
+
+        changed, self._pending = self._pending, set()
+        return changed
+
+    def _receive(self) -> Set[str]:
+        """Collect the table names from notifications received since the last call."""
+        self.connection.poll()
+        changed = {notify.payload for notify in self.connection.notifies if notify.payload}
+        self.connection.notifies.clear()
+        if changed:
+            self._record_lsn()
+        return changed
+
+    def _record_lsn(self):
+        """Remember the primary's current WAL position as the point pending changes were seen."""
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT pg_current_wal_lsn()::text;")
+        self._pending_lsn = cursor.fetchone()[0]
+        cursor.close()
+
+    def _wait_for_replay(self, schema_connection, timeout: float) -> bool:
+        """Wait until the schema connection has replayed WAL up to the pending changes."""
+        deadline = time.monotonic() + timeout
+        end_open_transaction(schema_connection)
+        cursor = schema_connection.cursor()
+        try:
+            while True:
+                cursor.execute(
+                    "SELECT NOT pg_is_in_recovery() OR pg_last_wal_replay_lsn() >= %s::pg_lsn;",
+                    (self._pending_lsn,)
+                )
+                replayed = cursor.fetchone()[0]
+                schema_connection.rollback()
+                if replayed or time.monotonic() >= deadline:
+                    return bool(replayed)
+                time.sleep(0.1)
+        finally:
+            cursor.close()
+
+    def close(self):
+        """Stop listening and close the connection."""
+        if self.connection is not None:
+            self.connection.close()
@@ -0,0 +1,181 @@
+# explain.py
+import re
+from typing import Dict, Iterable, List, Set, Tuple
+
+import sqlparse
+from psycopg2 import sql
+
+from query_executor import end_open_transaction, is_read_only_query
+
+# Plan keys holding join predicates
+JOIN_CONDITION_KEYS = ('Hash Cond', 'Merge Cond', 'Join Filter')
+COLUMN_REFERENCE = re.compile(r'\b(?:(\w+)\.)?(\w+)\b')
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+TYPE_CAST = re.compile(r"::[a-z_ ]+(\[\])?")
+# Longest identifier PostgreSQL keeps (NAMEDATALEN - 1), in bytes
+MAX_IDENTIFIER_BYTES = 63
+
+
+def explain_query(query: str, connection) -> Tuple[Dict, bool]:
+    """
+    Return the JSON plan of a single SQL statement.
+
+    Read-only SELECTs are run with EXPLAIN (ANALYZE, BUFFERS), which executes
+    them. Any other statement only gets a plain EXPLAIN, so it is planned but
+    never executed.
+
+    Returns:
+        Tuple of (plan, analyzed) where analyzed is True if the plan holds
+        actual row counts, timings and buffer usage
+
+    Raises:
+        ValueError: If the query does not consist of exactly one statement
+    """
+    statements = [statement for statement in sqlparse.split(query) if statement.strip()]
+    if len(statements) != 1:
+        raise ValueError("Only a single SQL statement can be explained.")
+
+    analyzed = is_read_only_query(statements[0])
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyzed else "FORMAT JSON"
+
+    end_open_transaction(connection)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN ({options}) {statements[0]}")
+        return cursor.fetchone()[0][0], analyzed
+    finally:
+        cursor.close()
+        connection.rollback()
+
+
+def get_indexed_columns(connection, tables: Iterable[str]) -> Dict[str, Set[str]]:
+    """Return the leading column of every index on the given tables, per table."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT t.relname, a.attname
+            FROM pg_index i
+            JOIN pg_class t ON t.oid = i.indrelid
+            JOIN pg_namespace n ON n.oid = t.relnamespace
+            JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = i.indkey[0]
+            WHERE n.nspname = 'public'
+            AND t.relname = ANY(%s);
+        """, (list(tables),))
+
+        indexed: Dict[str, Set[str]] = {}
+        for table, column in cursor.fetchall():
+            indexed.setdefault(table, set()).add(column)
+        return indexed
+    finally:
+        cursor.close()
+        connection.rollback()
+
+
+def flatten_plan(plan: Dict) -> List[Tuple[int, Dict, float]]:
+    """
+    Flatten a plan tree into (depth, node, exclusive cost) tuples, in display order.
+
+    For analyzed plans the exclusive cost is the node's own time in ms across all
+    loops, excluding its children. For plans that were not executed it is the
+    node's own share of the planner's total cost estimate.
+    """
+    nodes = []
+    analyzed = 'Actual Total Time' in plan['Plan']
+
+    def total_cost(node):
+        if analyzed:
+            return node.get('Actual Total Time', 0.0) * node.get('Actual Loops', 1)
+        return node.get('Total Cost', 0.0)
+
+    def visit(node, depth):
+        children = node.get('Plans', [])
+        children_total = sum(total_cost(child) for child in children)
+        nodes.append((depth, node, max(total_cost(node) - children_total, 0.0)))
+        for child in children:
+            visit(child, depth + 1)
+
+    visit(plan['Plan'], 0)
+    return nodes
+
+
+def suggest_indexes(
+        plan: Dict,
+        columns: Dict[str, List[str]],
+        primary_keys: Dict[str, str],
+        table_sizes: Dict[str, int],
+        indexed_columns: Dict[str, Set[str]],
+        min_rows: int
+) -> List[Tuple[str, str, str]]:
+    """
+    Find filter and join columns on sequentially scanned large tables that lack an index.
+
+    Args:
+        plan: Plan returned by explain_query
+        columns: Column names per table
+        primary_keys: Primary key column per table
+        table_sizes: Estimated row count per table
+        indexed_columns: Leading index columns per table
+        min_rows: Smallest table size considered large
+
+    Returns:
+        List of (table, column, reason) tuples
+    """
+    nodes = [node for _, node, _ in flatten_plan(plan)]
+    aliases = {node['Alias']: node['Relation Name'] for node in nodes if 'Relation Name' in node and 'Alias' in node}
+    seq_scanned = {
+        node['Relation Name'] for node in nodes
+        if node.get('Node Type') == 'Seq Scan'
+        and max(table_sizes.get(node['Relation Name'], 0), node.get('Plan Rows', 0)) >= min_rows
+    }
+
+    def needs_index(table, column):
+        return (
+            table in seq_scanned
+            and column in columns.get(table, [])
+            and column != primary_keys.get(table)
+            and column not in indexed_columns.get(table, set())
+        )
+
+    suggestions = []
+    for node in nodes:
+        predicates = []
+        if node.get('Node Type') == 'Seq Scan' and 'Filter' in node:
+            predicates.append(('filter', node['Filter'], node['Relation Name']))
+        for key in JOIN_CONDITION_KEYS:
+            if key in node:
+                predicates.append(('join', node[key], None))
+
+        for kind, expression, default_table in predicates:
+            for table, column in _column_references(expression, aliases, default_table):
+                if needs_index(table, column) and (table, column, kind) not in suggestions:
+                    suggestions.append((table, column, kind))
+
+    return suggestions
+
+
+def create_index_statement(table: str, column: str, connection) -> str:
+    """
+    Build a CREATE INDEX statement for a single column.
+
+    Names are quoted, so mixed-case or otherwise non-simple names are kept as
+    they are in the catalog, and the index name is cut to PostgreSQL's
+    identifier limit.
+    """
+    index_name = f"idx_{table}_{column}".encode()[:MAX_IDENTIFIER_BYTES].decode(errors='ignore')
+    return sql.SQL("CREATE INDEX CONCURRENTLY {} ON {} ({});").format(
+        sql.Identifier(index_name),
+        sql.Identifier(table),
+        sql.Identifier(column)
+    ).as_string(connection)
+
+
+def _column_references(expression: str, aliases: Dict[str, str], default_table: str) -> List[Tuple[str, str]]:
+    """Extract (table, column) pairs referenced by a plan predicate."""
+    expression = TYPE_CAST.sub('', STRING_LITERAL.sub('', expression))
+
+    references = []
+    for qualifier, name in COLUMN_REFERENCE.findall(expression):
+        table = aliases.get(qualifier, qualifier) if qualifier else default_table
+        if table:
+            references.append((table, name))
+    return references
@@ -0,0 +1,224 @@
+import json
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+
+import openai
+
+
+class LLMRequestError(Exception):
+    """Raised when an LLM request still fails after all retries."""
+
+
+class TokenBucket:
+    """A thread-safe token bucket rate limiter."""
+
+    def __init__(self, rate_per_second: float, capacity: int):
+        # A zero rate never refills and a capacity below one never holds a whole token
+        if rate_per_second <= 0:
+            raise ValueError(f"Rate limit must be positive, got {rate_per_second} requests per second")
+        if capacity < 1:
+            raise ValueError(f"Burst capacity must be at least 1, got {capacity}")
+
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Take one token, blocking until one is available.
+
+        Returns:
+            Number of seconds spent waiting for a token
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+
+                delay = (1 - self._tokens) / self.rate_per_second
+
+            time.sleep(delay)
+            waited += delay
+
+
+class _Call:
+    """An in-flight call shared by all callers using the same key."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single execution."""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run fn, or wait for the in-flight call with the same key.
+
+        Returns:
+            Tuple of (result, shared) where shared is True if the result came
+            from another caller's in-flight call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+
+class LLMClient:
+    """
+    Wraps the OpenAI client with rate limiting, retries and request coalescing.
+
+    Requests are throttled by a token bucket, retried with jittered exponential
+    backoff on rate limits, timeouts and server errors, and identical concurrent
+    requests share a single upstream call.
+    """
+
+    RETRYABLE_ERRORS = (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
+
+    def __init__(
+            self,
+            client_factory: Callable[[], openai.OpenAI],
+            requests_per_minute: float,
+            burst: int,
+            max_retries: int,
+            timeout: float,
+            backoff_base: float,
+            backoff_max: float
+    ):
+        if max_retries < 0:
+            raise ValueError(f"Retry count must not be negative, got {max_retries}")
+
+        self._client_factory = client_factory
+        self._client = None
+        self._client_lock = threading.Lock()
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._limiter = TokenBucket(requests_per_minute / 60.0, burst)
+        self._single_flight = SingleFlight()
+        self._stats = {
+            'requests': 0,
+            'retries': 0,
+            'throttled': 0,
+            'rate_limited': 0,
+            'timeouts': 0,
+            'coalesced': 0,
+            'failures': 0,
+        }
+        self._stats_lock = threading.Lock()
+
+    def chat_completion(self, coalesce: bool = True, **params):
+        """
+        Create a chat completion.
+
+        Args:
+            coalesce: Share the upstream request with identical concurrent calls.
+                Disable this when asking for independent samples of the same prompt.
+            **params: Arguments passed to chat.completions.create
+        """
+        if not coalesce:
+            return self._create_with_retries(params)
+
+        key = json.dumps(params, sort_keys=True, default=str)
+        response, shared = self._single_flight.do(key, lambda: self._create_with_retries(params))
+        if shared:
+            self._increment('coalesced')
+        return response
+
+    def client(self) -> openai.OpenAI:
+        """Return the underlying OpenAI client, creating it on first use."""
+        # Candidate generation calls this from several threads at once
+        with self._client_lock:
+            if self._client is None:
+                self._client = self._client_factory()
+            return self._client
+
+    def stats(self) -> Dict[str, int]:
+        """Return a snapshot of the request counters."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _create_with_retries(self, params: Dict[str, Any]):
+        """Send the request upstream, retrying transient failures with backoff."""
+        for attempt in range(self.max_retries + 1):
+            if self._limiter.acquire() > 0:
+                self._increment('throttled')
+
+            self._increment('requests')
+            try:
+                return self.client().chat.completions.create(timeout=self.timeout, **params)
+            except self.RETRYABLE_ERRORS as e:
+                if isinstance(e, openai.RateLimitError):
+                    self._increment('rate_limited')
+                elif isinstance(e, openai.APITimeoutError):
+                    self._increment('timeouts')
+
+                if attempt == self.max_retries:
+                    self._increment('failures')
+                    raise LLMRequestError(
+                        f"OpenAI request failed after {attempt + 1} attempts: {e}"
+                    ) from e
+
+                self._increment('retries')
+                time.sleep(self._backoff_delay(attempt, e))
+
+    def _backoff_delay(self, attempt: int, error: Exception) -> float:
+        """Full-jitter exponential backoff, honouring the server's Retry-After header."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, min(self.backoff_max, float(retry_after)))
+            except ValueError:
+                pass
+
+        return delay
+
+    def _increment(self, counter: str):
+        with self._stats_lock:
+            self._stats[counter] += 1
@@ -2,14 +2,23 @@ import os
 import sys
 import threading
 import time
-from typing import Optional, Set
+from typing import Optional, Set, Union
 
+import psycopg2
 import sqlparse
 from colorama import init, Fore, Style
 
-from db import get_connection, SchemaAnalyzer
-from openai_client import generate_sql_query
-from query_executor import execute_query
+from config import (
+    PREFETCH_ENABLED, PREFETCH_PAGE_SIZE, SQL_CANDIDATES,
+    DB_USER, DB_REPLICA_DSNS, REPLICA_MAX_LAG_SECONDS, SCHEMA_NODE,
+    SCHEMA_WATCH_ENABLED, SCHEMA_WATCH_CHANNEL, SCHEMA_WATCH_INSTALL_TRIGGER,
+    PREVIEW_MIN_ROWS, PREVIEW_TARGET_ROWS, PREVIEW_TIMEOUT_MS, INDEX_ADVISOR_MIN_ROWS
+)
+from db import get_connection, get_connection_pool, ReplicaRouter, SchemaAnalyzer, SchemaWatcher
+from explain import create_index_statement, explain_query, flatten_plan, get_indexed_columns, suggest_indexes
+from openai_client import generate_sql_query, generate_sql_candidates, llm_client
+from preview import execute_preview
+from query_executor import execute_query, is_prefetch_safe, is_read_only_query, rank_queries_by_cost, PrefetchedQuery
 from utils import pretty_print_results
 
 # Initialize colorama for cross-platform color support
@@ -107,6 +116,8 @@ def display_help():
   {Fore.LIGHTGREEN_EX}schema{Style.RESET_ALL}    - Show complete database schema with relationships
   {Fore.LIGHTGREEN_EX}describe <table>{Style.RESET_ALL} - Show detailed schema for a specific table
   {Fore.LIGHTGREEN_EX}history{Style.RESET_ALL}   - Show query history for this session
+  {Fore.LIGHTGREEN_EX}explain [sql]{Style.RESET_ALL} - Show the execution plan and index suggestions for the last or given query
+  {Fore.LIGHTGREEN_EX}stats{Style.RESET_ALL}     - Show LLM request, retry and throttling counters
   {Fore.LIGHTGREEN_EX}clear{Style.RESET_ALL}     - Clear the terminal screen
   {Fore.LIGHTGREEN_EX}exit{Style.RESET_ALL}      - Exit the application (or use 'quit')
 
@@ -123,6 +134,7 @@ def display_help():
   • Be specific about time ranges, columns, and conditions
   • Mention table names when querying multiple related tables
   • Results can be exported to CSV in the 'exports' directory
+  • Answer 'p' at the confirmation prompt for a quick sampled preview
   • Use Ctrl+C to cancel any operation
 """
     print(help_text)
@@ -189,11 +201,86 @@ def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
 
+def display_query_plan(sql_query: str, connection, schema_analyzer: SchemaAnalyzer):
+    """
+    Display the execution plan of a query and suggest missing indexes.
+
+    Only read-only SELECTs are executed to collect actual timings; for other
+    statements the planner's estimates are shown.
+
+    Raises:
+        psycopg2.Error: If the query cannot be planned
+    """
+    try:
+        with Spinner("Analyzing query plan..."):
+            plan, analyzed = explain_query(sql_query, connection)
+            nodes = flatten_plan(plan)
+            relations = {node['Relation Name'] for _, node, _ in nodes if 'Relation Name' in node}
+            indexed_columns = get_indexed_columns(connection, relations)
+    except ValueError as e:
+        print(f"\n{Fore.RED}❌ {e}{Style.RESET_ALL}\n")
+        return
+
+    print(f"\n{Fore.CYAN}╔════════════════════════════════════════╗")
+    print(f"║          QUERY EXECUTION PLAN          ║")
+    print(f"╚════════════════════════════════════════╝{Style.RESET_ALL}\n")
+    if not analyzed:
+        print(f"{Fore.YELLOW}⚠ Not a read-only SELECT, so the query was not executed; "
+              f"showing planner estimates only.{Style.RESET_ALL}\n")
+
+    # Highlight the nodes where most of the time (or estimated cost) is spent
+    total = plan.get('Execution Time', 0.0) if analyzed else plan['Plan'].get('Total Cost', 0.0)
+    hottest = sorted(nodes, key=lambda item: item[2], reverse=True)[:3]
+    hot_nodes = {id(node) for _, node, self_cost in hottest if self_cost >= 0.1 * total}
+
+    for depth, node, self_cost in nodes:
+        label = node['Node Type']
+        if 'Relation Name' in node:
+            label += f" on {node['Relation Name']}"
+            if node.get('Alias') != node['Relation Name']:
+                label += f" {node['Alias']}"
+        if 'Index Name' in node:
+            label += f" using {node['Index Name']}"
+
+        if analyzed:
+            details = (
+                f"rows={node.get('Actual Rows', 0)} (est {node.get('Plan Rows', 0)}) "
+                f"loops={node.get('Actual Loops', 1)} self={self_cost:.2f} ms "
+                f"buffers hit={node.get('Shared Hit Blocks', 0)} read={node.get('Shared Read Blocks', 0)}"
+            )
+        else:
+            details = f"est rows={node.get('Plan Rows', 0)} self cost={self_cost:.2f}"
+        color = Fore.RED if id(node) in hot_nodes else Fore.LIGHTGREEN_EX
+        print(f"{'  ' * depth}{color}→ {label}{Style.RESET_ALL} {Fore.LIGHTBLACK_EX}{details}{Style.RESET_ALL}")
+
+    if analyzed:
+        print(f"\n{Fore.CYAN}Planning: {plan.get('Planning Time', 0.0):.2f} ms, "
+              f"Execution: {total:.2f} ms{Style.RESET_ALL}")
+    else:
+        print(f"\n{Fore.CYAN}Estimated total cost: {total:.2f}{Style.RESET_ALL}")
+
+    suggestions = suggest_indexes(
+        plan,
+        {table: [col['name'] for col in columns] for table, columns in schema_analyzer.tables.items()},
+        schema_analyzer.primary_keys,
+        schema_analyzer.table_sizes,
+        indexed_columns,
+        INDEX_ADVISOR_MIN_ROWS
+    )
+    if suggestions:
+        print(f"\n{Fore.YELLOW}💡 Sequential scans on large tables without a supporting index:{Style.RESET_ALL}")
+        for table, column, kind in suggestions:
+            print(f"  {Fore.LIGHTBLACK_EX}{table}.{column} ({kind} predicate){Style.RESET_ALL}")
+            print(f"  {Fore.LIGHTBLUE_EX}→ {create_index_statement(table, column, connection)}{Style.RESET_ALL}")
+    print()
+
+
 def handle_special_commands(
         command: str,
         schema_analyzer: SchemaAnalyzer,
         schema_description: str,
-        query_history: list
+        query_history: list,
+        router: Optional[ReplicaRouter] = None
 ) -> bool:
     """
     Handle special CLI commands.
@@ -203,6 +290,7 @@ def handle_special_commands(
         schema_analyzer: Database schema analyzer
         schema_description: Full schema description
         query_history: List of executed queries
+        router: Router choosing the connection for 'explain'
 
     Returns:
         bool: True if command was handled, False if it's a regular query
@@ -244,6 +332,32 @@ def handle_special_commands(
         display_query_history(query_history)
         return True
 
+    # Handle query plan inspection of the last or given SQL
+    if router and (command_lower == 'explain' or command_lower.startswith('explain ')):
+        sql_query = command[8:].strip()
+        if sql_query and sqlparse.parse(sql_query)[0].get_type() == 'UNKNOWN':
+            # Not SQL, so treat it as a natural language question
+            return False
+        from_history = not sql_query
+        if from_history:
+            if not query_history:
+                print(f"\n{Fore.YELLOW}No queries executed in this session yet.{Style.RESET_ALL}\n")
+                return True
+            sql_query = query_history[-1]['sql']
+        try:
+            display_query_plan(sql_query, router.connection_for(sql_query), schema_analyzer)
+        except psycopg2.Error as e:
+            if not from_history:
+                # sqlparse also types prose such as "select customers who ..." as SELECT
+                return False
+            print(f"\n{Fore.RED}❌ Could not explain the last query: {str(e).strip()}{Style.RESET_ALL}\n")
+        return True
+
+    # Handle LLM client statistics
+    if command_lower == 'stats':
+        display_llm_stats()
+        return True
+
     return False
 
 
@@ -262,6 +376,45 @@ def display_query_history(query_history: list):
         print(f"   {Fore.LIGHTMAGENTA_EX}{query_info['sql'][:80]}...{Style.RESET_ALL}\n")
 
 
+def display_llm_stats():
+    """Display request counters of the LLM client for this session."""
+    print(f"\n{Fore.CYAN}╔════════════════════════════════════════╗")
+    print(f"║          LLM CLIENT STATISTICS         ║")
+    print(f"╚════════════════════════════════════════╝{Style.RESET_ALL}\n")
+
+    for name, value in llm_client.stats().items():
+        label = name.replace('_', ' ').capitalize()
+        print(f"  {Fore.LIGHTGREEN_EX}{label:<14}{Style.RESET_ALL} {value}")
+    print()
+
+
+def display_query_alternatives(ranked_queries: list, chosen: int = 0):
+    """
+    Display the estimated cost of the chosen query and the alternatives considered.
+
+    Alternatives are numbered by their rank, cheapest first, so they can be
+    selected at the confirmation prompt.
+    """
+    if not ranked_queries:
+        print(f"{Fore.YELLOW}⚠ None of the candidate queries could be planned.{Style.RESET_ALL}")
+        return
+
+    cost = ranked_queries[chosen][0]
+    ranking = "cheapest" if chosen == 0 else f"#{chosen + 1}"
+    print(f"{Fore.CYAN}💰 Estimated cost: {cost:,.2f} "
+          f"({ranking} of {len(ranked_queries)} planned candidates){Style.RESET_ALL}")
+
+    if len(ranked_queries) > 1:
+        print(f"{Fore.CYAN}Alternatives:{Style.RESET_ALL}")
+        for number, (cost, query) in enumerate(ranked_queries, 1):
+            if number - 1 == chosen:
+                continue
+            formatted_query = sqlparse.format(query, reindent=True, keyword_case='upper', strip_comments=True)
+            print(f"  {Fore.GREEN}{number}.{Style.RESET_ALL} {Fore.CYAN}[cost {cost:,.2f}]{Style.RESET_ALL}")
+            for line in formatted_query.splitlines():
+                print(f"     {Fore.LIGHTBLACK_EX}{line}{Style.RESET_ALL}")
+
+
 def display_welcome_banner():
     """Display an attractive welcome banner."""
     banner = f"""
@@ -282,44 +435,92 @@ def display_welcome_banner():
     print(banner)
 
 
-def confirm_execution() -> bool:
+def confirm_execution(allow_preview: bool = False, alternatives: int = 0) -> Union[str, int]:
     """
     Prompt user to confirm query execution with improved UX.
 
+    Args:
+        allow_preview: Whether to offer a sampled preview of the results
+        alternatives: Number of ranked candidate queries the user can switch to
+
     Returns:
-        bool: True if user confirms, False otherwise
+        'execute', 'preview', 'skip', or the 0-based rank of the chosen alternative
     """
+    options = "Y/n/p(review)/e(dit)" if allow_preview else "Y/n/e(dit)"
+    if alternatives > 1:
+        options += f"/1-{alternatives}"
     while True:
-        response = input(f"\n{Fore.YELLOW}Execute this query? [Y/n/e(dit)]:{Style.RESET_ALL} ").lower().strip()
+        response = input(f"\n{Fore.YELLOW}Execute this query? [{options}]:{Style.RESET_ALL} ").lower().strip()
 
-        if response in ('', 'y', 'yes'):
-            return True
+        if response.isdigit() and 1 <= int(response) <= alternatives:
+            return int(response) - 1
+        elif response in ('', 'y', 'yes'):
+            return 'execute'
         elif response in ('n', 'no'):
-            return False
+            return 'skip'
+        elif allow_preview and response in ('p', 'preview'):
+            return 'preview'
         elif response in ('e', 'edit'):
             print(f"{Fore.CYAN}Query editing not yet implemented. Skipping execution.{Style.RESET_ALL}")
-            return False
+            return 'skip'
+        else:
+            print(f"{Fore.RED}Invalid input. Please enter one of [{options}].{Style.RESET_ALL}")
+
+
+def display_preview_results(results_data: tuple, sampled_tables: dict, unscaled: bool = False):
+    """Display the results of a sampled preview, clearly labelled as approximate."""
+    results, column_names = results_data
+    if isinstance(results, str):
+        print(f"{Fore.RED}❌ {results}{Style.RESET_ALL}")
+        return
+
+    if sampled_tables:
+        samples = ', '.join(f"{table} {percent:g}%" for table, percent in sorted(sampled_tables.items()))
+        print(f"{Fore.YELLOW}⚠ SAMPLED PREVIEW - approximate results ({samples}).{Style.RESET_ALL}")
+        if unscaled:
+            print(f"{Fore.YELLOW}  Some aggregates could not be scaled and reflect the sample only.{Style.RESET_ALL}\n")
         else:
-            print(f"{Fore.RED}Invalid input. Please enter 'y' (yes), 'n' (no), or 'e' (edit).{Style.RESET_ALL}")
+            print(f"{Fore.YELLOW}  COUNT and SUM values are scaled estimates.{Style.RESET_ALL}\n")
+    else:
+        print(f"{Fore.YELLOW}⚠ No table is large enough to sample; showing exact results.{Style.RESET_ALL}\n")
+
+    pretty_print_results(results_data, export_option=False)
 
 
 def main_cli():
     """Main CLI function with improved error handling and UX."""
     query_history = []
+    connection_pool = None
+    router = None
+    schema_watcher = None
 
     try:
         # Initialize database connection
         with Spinner("Connecting to database..."):
             conn = get_connection()
+            router = ReplicaRouter(conn, DB_REPLICA_DSNS, REPLICA_MAX_LAG_SECONDS)
+            if SQL_CANDIDATES > 1:
+                connection_pool = get_connection_pool()
+
+        if DB_REPLICA_DSNS and not router.has_stats_privilege():
+            print(f"{Fore.YELLOW}⚠ The database role lacks pg_read_all_stats on a replica, so replica lag "
+                  f"and load cannot be measured reliably. Grant it with: "
+                  f"GRANT pg_read_all_stats TO {DB_USER};{Style.RESET_ALL}")
 
         # Create exports directory at startup
         os.makedirs('exports', exist_ok=True)
 
         # Analyze database schema
         with Spinner("Analyzing database schema..."):
-            schema_analyzer = SchemaAnalyzer(conn)
+            schema_analyzer = SchemaAnalyzer(router.schema_connection(SCHEMA_NODE))
             schema_description = schema_analyzer.analyze()
 
+        # Listen for schema changes so the description can be refreshed incrementally
+        if SCHEMA_WATCH_ENABLED:
+            with Spinner("Listening for schema changes..."):
+                schema_watcher = SchemaWatcher(SCHEMA_WATCH_CHANNEL)
+                schema_watcher.start(install_trigger=SCHEMA_WATCH_INSTALL_TRIGGER)
+
         # Display welcome banner
         display_welcome_banner()
 
@@ -329,12 +530,31 @@ def main_cli():
                 # Get user input
                 user_input = input(f"\n{Fore.GREEN}prompt2query >>{Style.RESET_ALL} ").strip()
 
+                # Pick up schema changes made since the last command
+                if schema_watcher:
+                    try:
+                        changed_tables = schema_watcher.poll(schema_analyzer.connection)
+                    except psycopg2.Error as e:
+                        print(f"{Fore.YELLOW}⚠ Lost the schema change listener and could not reconnect "
+                              f"({str(e).strip()}). Schema changes will no longer be picked up.{Style.RESET_ALL}")
+                        schema_watcher.close()
+                        schema_watcher = None
+                        changed_tables = set()
+
+                    if changed_tables is None:
+                        # Notifications may have been missed while the listener was down
+                        with Spinner("Reconnected to schema change notifications, re-analyzing schema..."):
+                            schema_description = schema_analyzer.analyze()
+                    elif changed_tables:
+                        with Spinner(f"Refreshing schema for {', '.join(sorted(changed_tables))}..."):
+                            schema_description = schema_analyzer.refresh(changed_tables)
+
                 # Handle empty input
                 if not user_input:
                     continue
 
                 # Handle special commands
-                if handle_special_commands(user_input, schema_analyzer, schema_description, query_history):
+                if handle_special_commands(user_input, schema_analyzer, schema_description, query_history, router):
                     if user_input.lower() in ('exit', 'quit', 'q'):
                         break
                     continue
@@ -351,25 +571,83 @@ def main_cli():
                             print(f"  {Fore.LIGHTBLUE_EX}→ {join}{Style.RESET_ALL}")
 
                 # Generate SQL query
-                with Spinner("Generating SQL query..."):
-                    sql_query = generate_sql_query(user_input, schema_description)
-
-                # Display generated query
-                print(f"\n{Fore.MAGENTA}📝 Generated SQL Query:{Style.RESET_ALL}")
-                print(f"{Fore.LIGHTBLACK_EX}{'─' * 60}{Style.RESET_ALL}")
-                formatted_query = sqlparse.format(
-                    sql_query,
-                    reindent=True,
-                    keyword_case='upper',
-                    strip_comments=True
-                )
-                print(f"{Fore.LIGHTMAGENTA_EX}{formatted_query}{Style.RESET_ALL}")
-                print(f"{Fore.LIGHTBLACK_EX}{'─' * 60}{Style.RESET_ALL}")
-
-                # Confirm execution
-                if confirm_execution():
+                ranked_queries = None
+                if SQL_CANDIDATES > 1:
+                    with Spinner(f"Generating {SQL_CANDIDATES} SQL query candidates..."):
+                        candidates = generate_sql_candidates(user_input, schema_description, SQL_CANDIDATES)
+                    with Spinner("Comparing query plans..."):
+                        ranked_queries = rank_queries_by_cost(candidates, connection_pool)
+                    sql_query = ranked_queries[0][1] if ranked_queries else candidates[0]
+                else:
+                    with Spinner("Generating SQL query..."):
+                        sql_query = generate_sql_query(user_input, schema_description)
+
+                chosen = 0
+                while True:
+                    # Display generated query
+                    print(f"\n{Fore.MAGENTA}📝 Generated SQL Query:{Style.RESET_ALL}")
+                    print(f"{Fore.LIGHTBLACK_EX}{'─' * 60}{Style.RESET_ALL}")
+                    formatted_query = sqlparse.format(
+                        sql_query,
+                        reindent=True,
+                        keyword_case='upper',
+                        strip_comments=True
+                    )
+                    print(f"{Fore.LIGHTMAGENTA_EX}{formatted_query}{Style.RESET_ALL}")
+                    print(f"{Fore.LIGHTBLACK_EX}{'─' * 60}{Style.RESET_ALL}")
+                    if ranked_queries is not None:
+                        display_query_alternatives(ranked_queries, chosen)
+
+                    # Route read-only queries to a replica when one is available
+                    query_conn = router.connection_for(sql_query)
+                    if query_conn is not conn:
+                        print(f"{Fore.LIGHTBLACK_EX}↪ Routing to read replica {query_conn.info.host}{Style.RESET_ALL}")
+
+                    # Start fetching results of safe read-only queries while the user reviews them
+                    read_only = is_read_only_query(sql_query)
+                    prefetch = None
+                    if PREFETCH_ENABLED and is_prefetch_safe(sql_query):
+                        prefetch = PrefetchedQuery(sql_query, query_conn, PREFETCH_PAGE_SIZE).start()
+
+                    # Confirm execution
+                    try:
+                        action = confirm_execution(
+                            allow_preview=read_only,
+                            alternatives=len(ranked_queries or [])
+                        )
+                    except BaseException:
+                        if prefetch:
+                            prefetch.cancel()
+                        raise
+
+                    # Switch to another candidate and show it instead
+                    if isinstance(action, int):
+                        if prefetch:
+                            prefetch.cancel()
+                        chosen = action
+                        sql_query = ranked_queries[chosen][1]
+                        continue
+                    break
+
+                if action == 'preview':
+                    if prefetch:
+                        prefetch.cancel()
+                    with Spinner("Running sampled preview..."):
+                        results, column_names, sampled_tables, unscaled = execute_preview(
+                            sql_query,
+                            query_conn,
+                            schema_analyzer.table_sizes,
+                            PREVIEW_MIN_ROWS,
+                            PREVIEW_TARGET_ROWS,
+                            PREVIEW_TIMEOUT_MS
+                        )
+                    display_preview_results((results, column_names), sampled_tables, unscaled)
+                elif action == 'execute':
                     with Spinner("Executing query..."):
-                        results_and_columns = execute_query(sql_query, conn)
+                        if prefetch:
+                            results_and_columns = prefetch.result()
+                        else:
+                            results_and_columns = execute_query(sql_query, query_conn)
 
                     print(f"{Fore.GREEN}✓ Query executed successfully!{Style.RESET_ALL}\n")
                     pretty_print_results(results_and_columns)
@@ -380,6 +658,8 @@ def main_cli():
                         'sql': sql_query
                     })
                 else:
+                    if prefetch:
+                        prefetch.cancel()
                     print(f"{Fore.YELLOW}⚠ Query execution skipped.{Style.RESET_ALL}")
 
             except KeyboardInterrupt:
@@ -401,6 +681,12 @@ def main_cli():
             conn.close()
         except:
             pass
+        if connection_pool:
+            connection_pool.closeall()
+        if router:
+            router.close()
+        if schema_watcher:
+            schema_watcher.close()
 
         print(f"\n{Fore.CYAN}{'═' * 60}")
         print(f"Thank you for using Prompt2Query CLI! 👋")
@@ -1,12 +1,27 @@
-import openai
-from config import OPENAI_API_KEY
-
-openai.api_key = OPENAI_API_KEY
-
+from concurrent.futures import ThreadPoolExecutor
 
-def generate_sql_query(user_prompt, schema):
+import openai
+from config import (
+    OPENAI_API_KEY, LLM_REQUESTS_PER_MINUTE, LLM_BURST, LLM_MAX_RETRIES,
+    LLM_TIMEOUT_SECONDS, LLM_BACKOFF_BASE_SECONDS, LLM_BACKOFF_MAX_SECONDS
+)
+from llm_client import LLMClient
+
+# Retries are handled by LLMClient, so the SDK's own retries are disabled
+llm_client = LLMClient(
+    lambda: openai.OpenAI(api_key=OPENAI_API_KEY, max_retries=0),
+    requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+    burst=LLM_BURST,
+    max_retries=LLM_MAX_RETRIES,
+    timeout=LLM_TIMEOUT_SECONDS,
+    backoff_base=LLM_BACKOFF_BASE_SECONDS,
+    backoff_max=LLM_BACKOFF_MAX_SECONDS
+)
+
+
+def build_messages(user_prompt, schema):
     """
-    Generate a SQL query from a natural language prompt using improved prompt engineering.
+    Build the chat messages used to ask the LLM for a SQL query.
     """
     system_prompt = """You are an expert SQL query generator. Your task is to:
 1. Analyze the given database schema
@@ -43,12 +58,22 @@ Important:
         prompt=user_prompt
     )
 
-    response = openai.chat.completions.create(
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": full_prompt}
+    ]
+
+
+def generate_sql_query(user_prompt, schema, coalesce=True):
+    """
+    Generate a SQL query from a natural language prompt using improved prompt engineering.
+
+    Identical concurrent requests share one upstream call unless coalesce is False.
+    """
+    response = llm_client.chat_completion(
+        coalesce=coalesce,
         model="gpt-5-mini",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": full_prompt}
-        ],
+        messages=build_messages(user_prompt, schema),
         response_format={"type": "text"}  # Ensure plain text response
     )
 
@@ -56,6 +81,32 @@ Important:
     return clean_query(query)
 
 
+def generate_sql_candidates(user_prompt, schema, count):
+    """
+    Generate several candidate SQL queries for the same prompt in parallel.
+
+    Candidates are requested independently rather than coalesced, as they are
+    meant to be separate samples. Duplicate candidates are removed, preserving
+    the order they were generated in. Failed requests are skipped; an error is
+    only raised if every request failed.
+    """
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        futures = [executor.submit(generate_sql_query, user_prompt, schema, False) for _ in range(count)]
+
+    queries = []
+    error = None
+    for future in futures:
+        try:
+            queries.append(future.result())
+        except Exception as e:
+            error = e
+
+    if not queries:
+        raise error
+
+    return list(dict.fromkeys(queries))
+
+
 def clean_query(query):
     query = query.strip()
     lines = query.splitlines()
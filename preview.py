@@ -0,0 +1,321 @@
+# preview.py
+import time
+from typing import Dict, List, Tuple, Union
+
+import psycopg2
+import sqlparse
+from psycopg2 import errors
+from sqlparse import sql, tokens
+
+from query_executor import begin_read_only, end_open_transaction
+
+# Aggregates whose sampled value is scaled up by the inverse sampling ratio
+SCALED_AGGREGATES = ('count', 'sum')
+# Aggregates that collapse the sampled rows of a scope into estimates
+AGGREGATES = SCALED_AGGREGATES + (
+    'avg', 'min', 'max', 'array_agg', 'string_agg', 'bool_and', 'bool_or',
+    'stddev', 'variance', 'percentile_cont', 'percentile_disc', 'mode',
+)
+MIN_SAMPLE_PERCENT = 0.0001
+
+
+def sample_percent(row_count: int, target_rows: int) -> float:
+    """Return the TABLESAMPLE percentage expected to read about target_rows rows."""
+    percent = target_rows / row_count * 100
+    return float(f"{max(MIN_SAMPLE_PERCENT, min(percent, 100.0)):.4g}")
+
+
+def build_preview_query(
+        query: str,
+        table_sizes: Dict[str, int],
+        min_rows: int,
+        target_rows: int
+) -> Tuple[str, Dict[str, float], bool]:
+    """
+    Rewrite a SELECT so that large base tables are read with TABLESAMPLE SYSTEM.
+
+    Tables with at least min_rows estimated rows are sampled so that roughly
+    target_rows rows are read from each. Within one SELECT level only the
+    largest such table is sampled, so that joins still find matching rows. COUNT and SUM aggregates computed over
+    sampled tables, directly or through CTEs and derived tables, are scaled by
+    the inverse sampling ratio.
+
+    Args:
+        query: The SELECT query to rewrite
+        table_sizes: Estimated row count per table
+        min_rows: Smallest table size that gets sampled
+        target_rows: Approximate number of rows to read from each sampled table
+
+    Returns:
+        Tuple containing:
+        - The rewritten query
+        - Sampling percentage per sampled table
+        - Whether some aggregates over sampled rows could not be scaled
+          (e.g. COUNT(DISTINCT ...) or aggregates over a UNION)
+    """
+    percents = {
+        table: sample_percent(rows, target_rows)
+        for table, rows in table_sizes.items()
+        if rows >= min_rows
+    }
+    percents = {table: percent for table, percent in percents.items() if percent < 100}
+
+    statement = sqlparse.parse(query)[0]
+    rewriter = _PreviewRewriter(percents)
+    rewriter.rewrite_scope(statement, {})
+    return str(statement), rewriter.sampled, rewriter.unscaled
+
+
+def execute_preview(
+        query: str,
+        connection,
+        table_sizes: Dict[str, int],
+        min_rows: int,
+        target_rows: int,
+        timeout_ms: int
+) -> Tuple[Union[List, str], List[str], Dict[str, float], bool]:
+    """
+    Execute a sampled version of a query within a latency budget.
+
+    The query runs in a READ ONLY transaction with a statement timeout. While a
+    smaller sample is still possible, each attempt gets half of the remaining
+    budget; if it is cancelled, it is retried with a sample ten times smaller.
+
+    Returns:
+        Tuple containing:
+        - Either a list of results or an error message string
+        - List of column names (empty if error)
+        - Sampling percentage per sampled table
+        - Whether some aggregates over sampled rows could not be scaled
+    """
+    deadline = time.monotonic() + timeout_ms / 1000
+
+    while True:
+        preview_query, sampled, unscaled = build_preview_query(query, table_sizes, min_rows, target_rows)
+        remaining_ms = int((deadline - time.monotonic()) * 1000)
+        if remaining_ms <= 0:
+            return f"Preview did not finish within {timeout_ms} ms.", [], sampled, unscaled
+
+        # Leave time for a retry with a smaller sample
+        can_retry = bool(sampled) and target_rows > 1
+        attempt_ms = max(1, remaining_ms // 2) if can_retry else remaining_ms
+
+        end_open_transaction(connection)
+        cursor = connection.cursor()
+        try:
+            begin_read_only(connection)
+            cursor.execute("SET LOCAL statement_timeout = %s", (attempt_ms,))
+            cursor.execute(preview_query)
+            results = cursor.fetchall()
+            column_names = [desc[0] for desc in cursor.description]
+            return results, column_names, sampled, unscaled
+        except errors.QueryCanceled:
+            if not can_retry:
+                return f"Preview did not finish within {timeout_ms} ms.", [], sampled, unscaled
+            target_rows = max(1, target_rows // 10)
+        except psycopg2.Error as e:
+            return f"Error executing preview: {e}", [], sampled, unscaled
+        finally:
+            cursor.close()
+            connection.rollback()
+
+
+def _is_subquery(token) -> bool:
+    """Check whether a parenthesis token holds a nested SELECT."""
+    if not isinstance(token, sql.Parenthesis):
+        return False
+    first = token.token_next(0)[1]
+    return first is not None and (first.ttype is tokens.DML or first.ttype is tokens.CTE)
+
+
+class _PreviewRewriter:
+    """Rewrites a parsed SELECT for sampling, one scope (SELECT level) at a time."""
+
+    def __init__(self, percents: Dict[str, float]):
+        self.percents = percents
+        self.sampled: Dict[str, float] = {}
+        self.unscaled = False
+        self._rewritten = set()  # ids of scopes already rewritten
+
+    def rewrite_scope(self, scope, cte_factors: Dict[str, float]) -> float:
+        """
+        Sample the large tables read by one SELECT scope and scale its aggregates.
+
+        Returns:
+            The factor by which the rows this scope produces are undersampled,
+            so that scopes reading from it as a CTE or derived table can scale
+            their own aggregates. Aggregating scopes return 1, as their
+            COUNT and SUM values are already scaled.
+        """
+        self._rewritten.add(id(scope))
+        cte_factors = dict(cte_factors)
+        for name, body in _cte_definitions(scope):
+            cte_factors[name] = self.rewrite_scope(body, cte_factors)
+
+        factor = 1.0
+        base_tables = []
+        for table_ref in _table_references(scope):
+            if _is_subquery(table_ref.tokens[0]):
+                factor *= self.rewrite_scope(table_ref.tokens[0], cte_factors)
+                continue
+
+            table = table_ref.get_real_name()
+            if table_ref.get_parent_name() is None and table in cte_factors:
+                factor *= cte_factors[table]
+            elif table in self.percents and table_ref.get_parent_name() in (None, 'public'):
+                base_tables.append(table_ref)
+
+        # Sampling both sides of a join leaves almost no matching rows, so only
+        # the largest table is sampled, and none if a sampled CTE or derived
+        # table is already read
+        if base_tables and factor == 1.0:
+            table_ref = min(base_tables, key=lambda ref: self.percents[ref.get_real_name()])
+            table = table_ref.get_real_name()
+            percent = self.percents[table]
+            leaves = list(table_ref.flatten())
+            leaves[-1].value += f" TABLESAMPLE SYSTEM ({percent:g})"
+            self.sampled[table] = percent
+            factor = 100 / percent
+
+        keywords = {token.normalized for token in scope.tokens if token.is_keyword}
+        # Branches of a set operation each need their own factor
+        combined = bool(keywords & {'UNION', 'UNION ALL', 'INTERSECT', 'EXCEPT'})
+        aggregates = bool(keywords & {'GROUP BY', 'DISTINCT'})
+
+        for token, is_select_item in _scope_tokens(scope):
+            if _is_subquery(token):
+                if id(token) not in self._rewritten:
+                    self.rewrite_scope(token, cte_factors)
+            elif isinstance(token, sql.Function) and (token.get_name() or '').lower() in AGGREGATES:
+                aggregates = True
+                if factor > 1 and (combined or not _scale_aggregate(token, factor, is_select_item)):
+                    self.unscaled = True
+
+        return 1.0 if aggregates or combined else factor
+
+
+def _cte_definitions(scope) -> List[Tuple[str, sql.Parenthesis]]:
+    """Return the (name, body) of each CTE defined by a WITH clause of the scope."""
+    definitions = []
+    after_with = False
+    for token in scope.tokens:
+        if token.is_whitespace:
+            continue
+        if token.ttype is tokens.CTE:
+            after_with = True
+            continue
+
+        if after_with:
+            candidates = token.get_identifiers() if isinstance(token, sql.IdentifierList) else [token]
+            for candidate in candidates:
+                if isinstance(candidate, sql.Identifier) and _is_subquery(candidate.tokens[-1]):
+                    definitions.append((candidate.tokens[0].value, candidate.tokens[-1]))
+        after_with = False
+
+    return definitions
+
+
+def _table_references(scope) -> List[sql.Identifier]:
+    """Find the tables and derived tables named directly after FROM or JOIN in a scope."""
+    references = []
+    after_from = False
+    for token in scope.tokens:
+        if token.is_whitespace:
+            continue
+
+        if token.is_keyword:
+            after_from = token.normalized == 'FROM' or token.normalized.endswith('JOIN')
+            continue
+
+        if after_from:
+            candidates = token.get_identifiers() if isinstance(token, sql.IdentifierList) else [token]
+            for candidate in candidates:
+                if not isinstance(candidate, sql.Identifier):
+                    continue
+                if candidate.tokens[0].ttype is tokens.Name or _is_subquery(candidate.tokens[0]):
+                    references.append(candidate)
+        after_from = False
+
+    return references
+
+
+def _scope_tokens(token_list, in_select_list: bool = False, top_level: bool = True):
+    """
+    Walk the tokens of a scope without entering nested subqueries.
+
+    Yields (token, is_select_item) pairs, where is_select_item is True for
+    tokens that are complete, unaliased entries of the scope's own select list.
+    """
+    for token in token_list.tokens:
+        if top_level and token.ttype is tokens.DML:
+            in_select_list = token.normalized == 'SELECT'
+        elif top_level and token.is_keyword:
+            in_select_list = False
+
+        is_select_item = in_select_list and (top_level or isinstance(token_list, sql.IdentifierList))
+        yield token, is_select_item
+
+        if token.is_group and not _is_subquery(token):
+            # Arguments of a function are never select items themselves
+            nested_in_select_list = in_select_list and not isinstance(token, sql.Function)
+            yield from _scope_tokens(token, nested_in_select_list, top_level=False)
+
+
+def _filter_clause_end(function: sql.Function):
+    """
+    Return the closing parenthesis of a FILTER (WHERE ...) clause following an aggregate.
+
+    sqlparse does not group FILTER with its aggregate, so the clause is found by
+    scanning the leaves of the whole statement.
+    """
+    root = function
+    while root.parent is not None:
+        root = root.parent
+
+    leaves = list(root.flatten())
+    position = leaves.index(list(function.flatten())[-1]) + 1
+    while position < len(leaves) and leaves[position].is_whitespace:
+        position += 1
+    if position == len(leaves) or leaves[position].value.upper() != 'FILTER':
+        return None
+
+    depth = 0
+    for leaf in leaves[position + 1:]:
+        if leaf.match(tokens.Punctuation, '('):
+            depth += 1
+        elif leaf.match(tokens.Punctuation, ')'):
+            depth -= 1
+            if depth == 0:
+                return leaf
+    return None
+
+
+def _scale_aggregate(function: sql.Function, factor: float, is_select_item: bool) -> bool:
+    """
+    Multiply a COUNT or SUM aggregate by the inverse sampling ratio.
+
+    Returns:
+        False if the aggregate's value over a sample cannot be scaled
+    """
+    name = function.get_name().lower()
+    if name not in SCALED_AGGREGATES:
+        return True
+
+    # Distinct counts and sums do not grow linearly with the sample size
+    if any(token.normalized == 'DISTINCT' for token in function.flatten()):
+        return False
+
+    # A FILTER clause must stay attached to the aggregate inside the multiplication
+    first = list(function.flatten())[0]
+    last = _filter_clause_end(function) or list(function.flatten())[-1]
+    if name == 'count':
+        first.value = f"ROUND({first.value}"
+        last.value += f" * {factor:.6g})::bigint"
+    else:
+        first.value = f"({first.value}"
+        last.value += f" * {factor:.6g})"
+
+    # Keep the column name the unscaled aggregate would have had
+    if is_select_item:
+        last.value += f" AS {name}"
+    return True
@@ -1,6 +1,12 @@
 # query_executor.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import psycopg2
-from typing import Tuple, List, Union
+import sqlparse
+from psycopg2 import extensions
+from sqlparse import sql
+from typing import Optional, Tuple, List, Union
 
 
 def execute_query(query, connection) -> Tuple[Union[List, str], List[str]]:
@@ -30,6 +36,239 @@ def execute_query(query, connection) -> Tuple[Union[List, str], List[str]]:
         return f"Error executing query: {e}", []
 
 
+def estimate_query_cost(query, connection) -> Optional[float]:
+    """
+    Estimate the total cost of a query using the planner, without running it.
+
+    Returns:
+        The planner's total cost, or None if the query could not be planned
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {query}")
+        plan = cursor.fetchone()[0]
+        return float(plan[0]['Plan']['Total Cost'])
+    except psycopg2.Error:
+        return None
+    finally:
+        cursor.close()
+        connection.rollback()
+
+
+def rank_queries_by_cost(queries: List[str], connection_pool) -> List[Tuple[float, str]]:
+    """
+    Plan each query concurrently on pooled connections and order them by estimated cost.
+
+    Only single read-only SELECT statements are planned, since the text is
+    sent to the server before the user has confirmed anything. Other queries,
+    and queries that fail to plan or get no connection, are dropped.
+
+    Returns:
+        List of (estimated cost, query) tuples, cheapest first
+    """
+    def plan(query):
+        try:
+            connection = connection_pool.getconn()
+        except psycopg2.Error:
+            # Includes pool.PoolError; the candidate is dropped like an unplannable one
+            return None
+        try:
+            return estimate_query_cost(query, connection)
+        finally:
+            connection_pool.putconn(connection)
+
+    queries = [query for query in queries if is_read_only_query(query)]
+    workers = max(1, min(len(queries), connection_pool.maxconn))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        costs = list(executor.map(plan, queries))
+
+    ranked = [(cost, query) for cost, query in zip(costs, queries) if cost is not None]
+    return sorted(ranked, key=lambda item: item[0])
+
+
+def is_read_only_query(query: str) -> bool:
+    """
+    Check whether a query is a single read-only SELECT statement.
+
+    Statements such as SELECT ... FOR UPDATE or SELECT ... INTO are rejected,
+    as they either lock rows or write to the database.
+    """
+    statements = [stmt for stmt in sqlparse.parse(query) if stmt.value.strip(" \n\t;")]
+    if len(statements) != 1:
+        return False
+
+    statement = statements[0]
+    if statement.get_type() != 'SELECT':
+        return False
+
+    keywords = [token for token in statement.flatten() if token.is_keyword]
+    for i, token in enumerate(keywords):
+        # Data-modifying CTEs and SELECT ... INTO
+        if token.ttype in sqlparse.tokens.DML and token.normalized != 'SELECT':
+            return False
+        if token.normalized == 'INTO':
+            return False
+        # Row-locking clauses
+        if token.normalized == 'FOR' and i + 1 < len(keywords):
+            if keywords[i + 1].normalized in ('UPDATE', 'SHARE', 'NO', 'KEY'):
+                return False
+
+    return True
+
+
+# Functions that may run before the user confirms a query. READ ONLY does not
+# stop side effects of functions such as pg_terminate_backend, pg_advisory_lock
+# or dblink_exec, so anything not listed here disables prefetching.
+PREFETCH_SAFE_FUNCTIONS = {
+    'abs', 'any', 'array_agg', 'avg', 'bool_and', 'bool_or', 'cast', 'ceil', 'ceiling',
+    'coalesce', 'concat', 'concat_ws', 'count', 'date_part', 'date_trunc', 'dense_rank',
+    'extract', 'filter', 'first_value', 'floor', 'greatest', 'initcap', 'json_agg',
+    'jsonb_agg', 'lag', 'last_value', 'lead', 'least', 'left', 'length', 'lower', 'ltrim',
+    'max', 'min', 'now', 'ntile', 'nullif', 'percent_rank', 'percentile_cont', 'rank',
+    'replace', 'right', 'round', 'row', 'row_number', 'rtrim', 'split_part', 'stddev',
+    'string_agg', 'substr', 'substring', 'sum', 'to_char', 'to_date', 'to_timestamp',
+    'trim', 'trunc', 'upper', 'variance',
+}
+
+
+def is_prefetch_safe(query: str) -> bool:
+    """
+    Check whether a query may be executed before the user confirms it.
+
+    The query must be read-only and only call functions from
+    PREFETCH_SAFE_FUNCTIONS, without a schema qualifier.
+    """
+    if not is_read_only_query(query):
+        return False
+
+    # Calls are found on the token stream rather than through sql.Function,
+    # which sqlparse does not build for quoted names such as "f"(1)
+    leaves = [token for token in sqlparse.parse(query)[0].flatten() if not token.is_whitespace]
+    for i, token in enumerate(leaves[:-1]):
+        if not leaves[i + 1].match(sqlparse.tokens.Punctuation, '('):
+            continue
+        if token.ttype not in sqlparse.tokens.Name and token.ttype is not sqlparse.tokens.String.Symbol:
+            continue
+
+        previous = leaves[i - 1] if i > 0 else None
+        # Type modifiers such as ::varchar(10) or CAST(x AS numeric(10, 2))
+        if previous is not None and (previous.match(sqlparse.tokens.Punctuation, '::')
+                                     or previous.match(sqlparse.tokens.Keyword, 'AS')):
+            continue
+
+        # Quoted names keep their case, unquoted ones are folded to lower case
+        if token.ttype is sqlparse.tokens.String.Symbol:
+            name = token.value[1:-1].replace('""', '"')
+        else:
+            name = token.value.lower()
+        if name not in PREFETCH_SAFE_FUNCTIONS:
+            return False
+        # Schema-qualified calls may resolve to user-defined functions
+        if previous is not None and previous.match(sqlparse.tokens.Punctuation, '.'):
+            return False
+
+    return True
+
+
+def end_open_transaction(connection):
+    """
+    Roll back any transaction left open on the connection.
+
+    Successful queries are committed by execute_query, so an open transaction
+    only holds catalog reads (e.g. from schema analysis) or a failed statement.
+    """
+    if connection.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+
+
+def begin_read_only(connection):
+    """Start a READ ONLY transaction on the connection."""
+    cursor = connection.cursor()
+    cursor.execute("SET TRANSACTION READ ONLY")
+    cursor.close()
+
+
+class PrefetchedQuery:
+    """
+    Speculatively executes a read-only query in the background.
+
+    The query runs inside a READ ONLY transaction through a server-side cursor,
+    and the first page of rows is fetched while the user is still reviewing the
+    SQL. If the user confirms, the remaining rows are read from the same cursor;
+    if not, the running statement is cancelled and the transaction rolled back.
+    """
+
+    def __init__(self, query: str, connection, page_size: int = 100):
+        self.query = query
+        self.connection = connection
+        self.page_size = page_size
+        self._cursor = None
+        self._first_page: List = []
+        self._column_names: List[str] = []
+        self._error = None
+        self._thread = None
+
+    def start(self) -> 'PrefetchedQuery':
+        """Start executing the query in a background thread."""
+        end_open_transaction(self.connection)
+        self._thread = threading.Thread(target=self._prefetch, daemon=True)
+        self._thread.start()
+        return self
+
+    def _prefetch(self):
+        """Open the read-only transaction and fetch the first page."""
+        try:
+            begin_read_only(self.connection)
+
+            self._cursor = self.connection.cursor(name='prompt2query_prefetch')
+            self._cursor.itersize = self.page_size
+            self._cursor.execute(self.query)
+            self._first_page = self._cursor.fetchmany(self.page_size)
+            self._column_names = [desc[0] for desc in self._cursor.description]
+        except Exception as e:
+            self._error = e
+
+    def result(self) -> Tuple[Union[List, str], List[str]]:
+        """
+        Wait for the prefetch and return the full results.
+
+        If the speculative run failed, the query is executed again the
+        regular way so the user sees the same outcome as without prefetching.
+
+        Returns:
+            The same (results, column_names) tuple as execute_query
+        """
+        self._thread.join()
+        if self._error is None:
+            try:
+                results = self._first_page + self._cursor.fetchall()
+                return results, self._column_names
+            except psycopg2.Error:
+                pass
+            finally:
+                self._close()
+
+        self._close()
+        return execute_query(self.query, self.connection)
+
+    def cancel(self):
+        """Cancel the query if it is still running and discard any fetched rows."""
+        if self._thread.is_alive():
+            self.connection.cancel()
+        self._thread.join()
+        self._first_page = []
+        self._close()
+
+    def _close(self):
+        """Close the cursor and end the read-only transaction."""
+        try:
+            if self._cursor is not None and not self._cursor.closed:
+                self._cursor.close()
+        except psycopg2.Error:
+            pass
+        self.connection.rollback()
+
+
 # utils.py
 from tabulate import tabulate
 from typing import Union, List, Tuple
@@ -61,4 +300,4 @@ def pretty_print_results(results_data: Union[Tuple[List, List[str]], Tuple[str,
             print(row[0])
     else:
         # Multi-column results
-        print(tabulate(results, headers=column_names, tablefmt="psql"))
\ No newline at end of file
+        print(tabulate(results, headers=column_names, tablefmt="psql"))
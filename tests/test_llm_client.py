@@ -0,0 +1,162 @@
+import threading
+import time
+from unittest import mock
+
+import openai
+import pytest
+
+import llm_client
+from llm_client import LLMClient, LLMRequestError, SingleFlight, TokenBucket
+
+
+def make_client(create, max_retries=2):
+    factory = mock.Mock(return_value=mock.Mock(**{'chat.completions.create.side_effect': create}))
+    client = LLMClient(
+        factory,
+        requests_per_minute=6000,
+        burst=10,
+        max_retries=max_retries,
+        timeout=5,
+        backoff_base=1,
+        backoff_max=30
+    )
+    return client, factory
+
+
+def rate_limit_error(retry_after=None):
+    headers = {'retry-after': retry_after} if retry_after else {}
+    return openai.RateLimitError("slow down", response=mock.Mock(status_code=429, headers=headers), body=None)
+
+
+def wait_for_follower(flight, key='key'):
+    """Block until a second caller is waiting on the in-flight call for key."""
+    while not flight._calls[key].done._cond._waiters:
+        time.sleep(0.001)
+
+
+def test_token_bucket_allows_burst_without_waiting():
+    bucket = TokenBucket(rate_per_second=1, capacity=3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+
+
+def test_token_bucket_waits_for_refill_when_empty():
+    bucket = TokenBucket(rate_per_second=100, capacity=1)
+    bucket.acquire()
+    started = time.monotonic()
+    waited = bucket.acquire()
+    assert waited > 0
+    assert time.monotonic() - started >= 0.005
+
+
+@pytest.mark.parametrize('rate, capacity', [(0, 5), (-1, 5), (1, 0)])
+def test_token_bucket_rejects_settings_that_never_grant_a_token(rate, capacity):
+    with pytest.raises(ValueError):
+        TokenBucket(rate_per_second=rate, capacity=capacity)
+
+
+def test_single_flight_shares_result_of_in_flight_call():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def leader_fn():
+        calls.append('leader')
+        started.set()
+        release.wait()
+        return 42
+
+    results = {}
+    leader = threading.Thread(target=lambda: results.update(leader=flight.do('key', leader_fn)))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=lambda: results.update(follower=flight.do('key', lambda: calls.append('x'))))
+    follower.start()
+    wait_for_follower(flight)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert results == {'leader': (42, False), 'follower': (42, True)}
+    assert calls == ['leader']
+    assert flight._calls == {}
+
+
+def test_single_flight_shares_exception_and_cleans_up_key():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        release.wait()
+        raise RuntimeError("boom")
+
+    def run(fn):
+        try:
+            flight.do('key', fn)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=run, args=(failing,))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=run, args=(lambda: None,))
+    follower.start()
+    wait_for_follower(flight)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert len(errors) == 2 and errors[0] is errors[1]
+    assert flight._calls == {}
+    assert flight.do('key', lambda: 'fresh') == ('fresh', False)
+
+
+def test_retries_transient_errors_with_backoff():
+    client, factory = make_client([rate_limit_error(), openai.APIConnectionError(request=mock.Mock()), 'ok'])
+    with mock.patch.object(llm_client.time, 'sleep') as sleep:
+        assert client.chat_completion(model='m') == 'ok'
+
+    assert sleep.call_count == 2
+    assert factory.call_count == 1
+    stats = client.stats()
+    assert stats['requests'] == 3
+    assert stats['retries'] == 2
+    assert stats['rate_limited'] == 1
+    assert stats['failures'] == 0
+
+
+def test_gives_up_after_max_retries():
+    def always_rate_limited(**params):
+        raise rate_limit_error()
+
+    client, _ = make_client(always_rate_limited, max_retries=1)
+    with mock.patch.object(llm_client.time, 'sleep'):
+        with pytest.raises(LLMRequestError):
+            client.chat_completion(model='m')
+
+    stats = client.stats()
+    assert stats['requests'] == 2
+    assert stats['failures'] == 1
+
+
+def test_backoff_honours_retry_after_and_cap():
+    client, _ = make_client(['ok'])
+    assert client._backoff_delay(0, rate_limit_error(retry_after='7')) >= 7
+    assert client._backoff_delay(10, rate_limit_error(retry_after='600')) <= 30
+    assert 0 <= client._backoff_delay(3, rate_limit_error()) <= 8
+
+
+def test_negative_retry_count_is_rejected():
+    with pytest.raises(ValueError):
+        make_client(['ok'], max_retries=-1)
+
+
+def test_client_is_created_once_across_threads():
+    client, factory = make_client(['ok'])
+    threads = [threading.Thread(target=client.client) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert factory.call_count == 1
@@ -0,0 +1,125 @@
+from unittest import mock
+
+from psycopg2 import errors
+
+from preview import build_preview_query, execute_preview, sample_percent
+
+TABLE_SIZES = {'orders': 100_000_000, 'line_items': 500_000_000, 'users': 100}
+
+
+def preview(query):
+    return build_preview_query(query, TABLE_SIZES, min_rows=1_000_000, target_rows=10_000)
+
+
+def test_sample_percent_targets_row_count():
+    assert sample_percent(100_000_000, 10_000) == 0.01
+    assert sample_percent(5_000, 10_000) == 100.0
+
+
+def test_small_tables_are_not_sampled():
+    query, sampled, unscaled = preview("SELECT count(*) FROM users")
+    assert query == "SELECT count(*) FROM users"
+    assert sampled == {}
+    assert not unscaled
+
+
+def test_count_over_sampled_table_is_scaled():
+    query, sampled, unscaled = preview("SELECT count(*) FROM orders")
+    assert query == "SELECT ROUND(count(*) * 10000)::bigint AS count FROM orders TABLESAMPLE SYSTEM (0.01)"
+    assert sampled == {'orders': 0.01}
+    assert not unscaled
+
+
+def test_aliased_sum_keeps_alias():
+    query, _, _ = preview("SELECT sum(total) AS revenue FROM orders o")
+    assert query == "SELECT (sum(total) * 10000) AS revenue FROM orders o TABLESAMPLE SYSTEM (0.01)"
+
+
+def test_factor_propagates_through_cte():
+    query, _, unscaled = preview("WITH x AS (SELECT * FROM orders WHERE paid) SELECT count(*) FROM x")
+    assert query == (
+        "WITH x AS (SELECT * FROM orders TABLESAMPLE SYSTEM (0.01) WHERE paid) "
+        "SELECT ROUND(count(*) * 10000)::bigint AS count FROM x"
+    )
+    assert not unscaled
+
+
+def test_factor_propagates_through_derived_table():
+    query, _, _ = preview("SELECT count(*) FROM (SELECT * FROM orders) d")
+    assert query == (
+        "SELECT ROUND(count(*) * 10000)::bigint AS count "
+        "FROM (SELECT * FROM orders TABLESAMPLE SYSTEM (0.01)) d"
+    )
+
+
+def test_aggregated_derived_table_is_not_scaled_twice():
+    query, _, _ = preview("SELECT max(n) FROM (SELECT count(*) AS n FROM orders GROUP BY user_id) g")
+    assert query == (
+        "SELECT max(n) FROM (SELECT ROUND(count(*) * 10000)::bigint AS n "
+        "FROM orders TABLESAMPLE SYSTEM (0.01) GROUP BY user_id) g"
+    )
+
+
+def test_filter_clause_stays_attached_to_aggregate():
+    query, _, _ = preview("SELECT count(*) FILTER (WHERE paid) AS paid, count(*) FILTER (WHERE refunded) FROM orders")
+    assert query == (
+        "SELECT ROUND(count(*) FILTER (WHERE paid) * 10000)::bigint AS paid, "
+        "ROUND(count(*) FILTER (WHERE refunded) * 10000)::bigint AS count "
+        "FROM orders TABLESAMPLE SYSTEM (0.01)"
+    )
+
+
+def test_only_largest_table_of_a_join_is_sampled():
+    query, sampled, _ = preview(
+        "SELECT count(*) FROM orders o JOIN line_items li ON li.order_id = o.id"
+    )
+    assert query == (
+        "SELECT ROUND(count(*) * 50000)::bigint AS count "
+        "FROM orders o JOIN line_items li TABLESAMPLE SYSTEM (0.002) ON li.order_id = o.id"
+    )
+    assert sampled == {'line_items': 0.002}
+
+
+def test_tables_joined_to_a_sampled_cte_are_not_sampled():
+    query, sampled, _ = preview(
+        "WITH x AS (SELECT * FROM orders) SELECT count(*) FROM x JOIN line_items li ON li.order_id = x.id"
+    )
+    assert "line_items li TABLESAMPLE" not in query
+    assert sampled == {'orders': 0.01}
+
+
+def test_subquery_in_where_is_sampled():
+    query, sampled, _ = preview("SELECT * FROM users WHERE id IN (SELECT user_id FROM orders)")
+    assert query == "SELECT * FROM users WHERE id IN (SELECT user_id FROM orders TABLESAMPLE SYSTEM (0.01))"
+    assert sampled == {'orders': 0.01}
+
+
+def test_distinct_count_is_reported_unscaled():
+    query, _, unscaled = preview("SELECT count(DISTINCT user_id) FROM orders")
+    assert query == "SELECT count(DISTINCT user_id) FROM orders TABLESAMPLE SYSTEM (0.01)"
+    assert unscaled
+
+
+def test_aggregates_over_union_are_reported_unscaled():
+    query, _, unscaled = preview("SELECT count(*) FROM orders UNION ALL SELECT count(*) FROM users")
+    assert "ROUND" not in query
+    assert unscaled
+
+
+def test_cancelled_preview_is_retried_with_smaller_sample():
+    cursor = mock.Mock(description=[('count',)])
+    cursor.execute.side_effect = [None, errors.QueryCanceled(), None, None]
+    cursor.fetchall.return_value = [(42,)]
+    connection = mock.Mock(**{'cursor.return_value': cursor})
+
+    with mock.patch('preview.end_open_transaction'), mock.patch('preview.begin_read_only'):
+        results, columns, sampled, _ = execute_preview(
+            "SELECT count(*) FROM orders", connection, TABLE_SIZES, 1_000_000, 10_000, timeout_ms=1000
+        )
+
+    assert results == [(42,)]
+    assert sampled == {'orders': 0.001}
+    first_timeout = cursor.execute.call_args_list[0].args[1][0]
+    second_timeout = cursor.execute.call_args_list[2].args[1][0]
+    assert first_timeout <= 500
+    assert 0 < second_timeout <= 500
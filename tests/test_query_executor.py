@@ -0,0 +1,54 @@
+import pytest
+
+from query_executor import is_prefetch_safe, is_read_only_query
+
+
+@pytest.mark.parametrize('query', [
+    "SELECT * FROM orders",
+    "SELECT * FROM orders;",
+    "WITH x AS (SELECT * FROM orders) SELECT count(*) FROM x",
+    "SELECT o.id FROM orders o JOIN users u ON u.id = o.user_id WHERE u.name = 'for update'",
+])
+def test_read_only_queries(query):
+    assert is_read_only_query(query)
+
+
+@pytest.mark.parametrize('query', [
+    "DELETE FROM orders",
+    "SELECT 1; DELETE FROM orders",
+    "SELECT * FROM orders FOR UPDATE",
+    "SELECT * FROM orders FOR NO KEY UPDATE",
+    "SELECT * FROM orders FOR SHARE",
+    "SELECT * INTO orders_copy FROM orders",
+    "WITH gone AS (DELETE FROM orders RETURNING *) SELECT * FROM gone",
+])
+def test_writing_or_locking_queries_are_not_read_only(query):
+    assert not is_read_only_query(query)
+
+
+@pytest.mark.parametrize('query', [
+    "SELECT count(*), max(total) FROM orders",
+    "SELECT coalesce(name, 'n/a'), lower(email) FROM users",
+    "SELECT CAST(total AS numeric(10, 2)), created_at::varchar(10) FROM orders",
+    "SELECT count(*) FILTER (WHERE paid) FROM orders",
+    "SELECT rank() OVER (PARTITION BY user_id ORDER BY total) FROM orders",
+    "SELECT * FROM orders WHERE user_id IN (SELECT id FROM users) AND EXISTS (SELECT 1)",
+    'SELECT "count"(*) FROM orders',
+])
+def test_allowlisted_calls_are_prefetch_safe(query):
+    assert is_prefetch_safe(query)
+
+
+@pytest.mark.parametrize('query', [
+    "SELECT pg_terminate_backend(123)",
+    "SELECT pg_sleep(10)",
+    'SELECT "pg_terminate_backend"(123)',
+    'SELECT "pg_catalog"."pg_terminate_backend"(1)',
+    "SELECT pg_catalog.pg_terminate_backend(1)",
+    'SELECT count(*) FROM orders WHERE "pg_advisory_lock"(1) IS NOT NULL',
+    "SELECT public.lower(name) FROM users",
+    'SELECT "COUNT"(*) FROM orders',
+    "DELETE FROM orders",
+])
+def test_other_calls_are_not_prefetch_safe(query):
+    assert not is_prefetch_safe(query)